@@ -4,57 +4,141 @@ import pandas as pd
 from pathlib import Path
 from datetime import datetime, date, time, timedelta
 import math
+import os
+import sys
+import socket
+import importlib
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import numpy as np
 
 # =========================================================
 # FUNÇÕES DE FORMATAÇÃO (Reutilizáveis)
 # =========================================================
-
-def fmt_res(v):
-    """Formata um número para o padrão R$ 1.234,00"""
-    if pd.isna(v):
-        return ""
-    try:
-        val = float(v)
-        return f"R$ {val:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except (ValueError, TypeError):
-        return str(v)
-
-def color_res(v_str):
-    """Cor baseada no valor (lê o formato R$ 1.234,00)"""
-    if not isinstance(v_str, str) or not v_str.startswith("R$"):
-        try:
-            val = float(v_str)
-        except (ValueError, TypeError):
-            return ""
+# Trabalham sobre colunas inteiras: cada função recebe a coluna numérica e devolve
+# os textos (ou as classes CSS) da coluna toda, sem formatar célula a célula nem
+# reler o texto formatado para decidir a cor. Textos que não são número (ex.: "",
+# "Controlada", "05/03") passam direto.
+
+CSS_TABELAS = """
+    .tabela-container td.res-pos { color: #22c55e; font-weight: 600; }
+    .tabela-container td.res-neg { color: #ef4444; font-weight: 600; }
+    .tabela-container td.res-zero { color: #e5e7eb; }
+    .tabela-container td.lado-alta { color: #22c55e; }
+    .tabela-container td.lado-baixa { color: #ef4444; }
+    .tabela-container td.ent-compra { color: #3b82f6; }
+    .tabela-container td.ent-venda { color: #d946ef; }
+    .tabela-container td.destaque-pos { color: #22c55e; font-weight: bold; }
+    .tabela-container td.destaque-neg { color: #ef4444; font-weight: bold; }
+    .tabela-container td.destaque-alerta { color: #facc15; font-weight: bold; }
+    .tabela-container tr.linha-total th, .tabela-container tr.linha-total td { background-color: #374151; }
+"""
+
+def _como_texto(valores, formatar):
+    """Aplica `formatar` (vetorizado) nos valores numéricos; NaN vira "" e texto passa direto."""
+    s = pd.Series(valores).reset_index(drop=True)
+    v = pd.to_numeric(s, errors="coerce")
+    ok = v.notna().to_numpy()
+    out = s.astype(object).where(s.notna(), "").astype(str).to_numpy(dtype=object)
+    if ok.any():
+        out[ok] = formatar(v[ok].astype(float)).to_numpy(dtype=object)
+    return out
+
+def _fixo(v, casas=2, milhar=True, dec_sep=","):
+    """
+    Número com `casas` decimais, separador de milhar '.' e decimal ',' (padrão BR).
+    O arredondamento fica com o "%.Nf" do Python (np.char.mod), igual ao f"{v:,.2f}",
+    que arredonda o valor binário real (83.525 -> 83,53; 6.175 -> 6,17).
+    """
+    arr = v.to_numpy(dtype=float)
+    texto = pd.Series(np.char.mod(f"%.{casas}f", np.abs(arr)), index=v.index).astype(str)
+    if casas:
+        partes = texto.str.split(".", n=1, expand=True)
+        inteiro, decimais = partes[0], dec_sep + partes[1]
     else:
-        try:
-            val = float(v_str.replace("R$ ", "").replace(".", "").replace(",", "."))
-        except (ValueError, TypeError):
-            return ""
-            
-    if val > 0:
-        return "color: #22c55e; font-weight: 600;"  # verde
-    elif val < 0:
-        return "color: #ef4444; font-weight: 600;"  # vermelho
+        inteiro, decimais = texto, ""
+    if milhar:
+        inteiro = inteiro.str.replace(r"\B(?=(\d{3})+(?!\d))", ".", regex=True)
+    return pd.Series(np.where(np.signbit(arr), "-", ""), index=v.index) + inteiro + decimais
+
+def fmt_res_col(valores):
+    """R$ 1.234,00"""
+    return _como_texto(valores, lambda v: "R$ " + _fixo(v, 2))
+
+def fmt_price_col(valores):
+    """1.234 (sem decimais)"""
+    return _como_texto(valores, lambda v: _fixo(v, 0))
+
+def fmt_box_col(valores):
+    return _como_texto(valores, lambda v: v.astype(np.int64).astype(str))
+
+fmt_inteiro_col = fmt_box_col
+
+def fmt_decimal_col(valores):
+    """1,23"""
+    return _como_texto(valores, lambda v: _fixo(v, 2, milhar=False))
+
+def fmt_percent_col(valores):
+    """Fração -> 12,34%"""
+    return _como_texto(valores, lambda v: _fixo(v * 100, 2, milhar=False) + "%")
+
+def fmt_offset_col(valores):
+    """+50 / -50"""
+    return _como_texto(valores, lambda v: pd.Series(np.where(np.signbit(v.to_numpy(dtype=float)), "", "+"), index=v.index) + _fixo(v, 0, milhar=False))
+
+def fmt_texto_col(valores):
+    """Padrão para colunas sem formatador: str() do valor, vazio para NaN."""
+    s = pd.Series(valores).reset_index(drop=True)
+    return s.astype(object).where(s.notna(), "").astype(str).to_numpy(dtype=object)
+
+def formatar_colunas(df, formatos):
+    """Textos de todas as colunas de `df`, usando formatos[col] ou fmt_texto_col."""
+    return {c: formatos.get(c, fmt_texto_col)(df[c]) for c in df.columns}
+
+def fmt_data_col(valores):
+    datas = pd.to_datetime(pd.Series(valores).reset_index(drop=True), errors="coerce")
+    return datas.dt.strftime("%d-%m-%Y").fillna("").to_numpy(dtype=object)
+
+def classe_res_col(valores):
+    """Classe da cor pelo sinal: res-pos / res-neg / res-zero ("" para texto/vazio)."""
+    v = pd.to_numeric(pd.Series(valores), errors="coerce").to_numpy(dtype=float)
+    return np.select([v > 0, v < 0, v == 0], ["res-pos", "res-neg", "res-zero"], default="")
+
+def classe_mapa_col(valores, mapa):
+    """Classe por valor exato (ex.: {"Compra": "ent-compra"}); demais ficam sem classe."""
+    return pd.Series(valores).map(mapa).fillna("").to_numpy(dtype=object)
+
+def tabela_html(textos, classes=None, indice=None, classes_linha=None):
+    """
+    Monta o <table> a partir de colunas já formatadas (dict ou DataFrame de textos),
+    concatenando coluna a coluna. `classes` = mesmas chaves com a classe CSS de cada célula,
+    `indice` = rótulos de linha (<th>) e `classes_linha` = classe de cada <tr>.
+    """
+    textos = pd.DataFrame(textos) if not isinstance(textos, pd.DataFrame) else textos
+    classes = classes or {}
+    n = len(textos)
+    cabecalho = ("<th></th>" if indice is not None else "") + "".join(f"<th>{c}</th>" for c in textos.columns)
+
+    linhas = pd.Series(np.full(n, "", dtype=object))
+    if indice is not None:
+        linhas = linhas + "<th>" + pd.Series(np.asarray(indice, dtype=object)).astype(str) + "</th>"
+    for j, col in enumerate(textos.columns):
+        celula = pd.Series(textos.iloc[:, j].to_numpy(dtype=object)).astype(str)
+        if col in classes:
+            cls = pd.Series(np.asarray(classes[col], dtype=object)).astype(str)
+            abre = pd.Series(np.where(cls != "", '<td class="' + cls + '">', "<td>"))
+        else:
+            abre = "<td>"
+        linhas = linhas + abre + celula + "</td>"
+    if classes_linha is not None:
+        cls = pd.Series(np.asarray(classes_linha, dtype=object)).astype(str)
+        abre_tr = pd.Series(np.where(cls != "", '<tr class="' + cls + '">', "<tr>"))
     else:
-        return "color: #e5e7eb;" # Cinza claro (neutro)
-
-def fmt_data(x):
-    try:
-        return pd.to_datetime(x).strftime("%d-%m-%Y")
-    except Exception:
-        return ""
-
-def fmt_price(v):
-    if pd.isna(v):
-        return ""
-    return f"{v:,.0f}".replace(",", ".")
-
-def fmt_box(v):
-    if pd.isna(v):
-        return "" 
-    return f"{int(v)}"
+        abre_tr = "<tr>"
+    linhas = abre_tr + linhas + "</tr>"
+    return f"<table><thead><tr>{cabecalho}</tr></thead><tbody>{''.join(linhas)}</tbody></table>"
 
 # =========================================================
 # Carregamento de dados
@@ -83,19 +167,17 @@ def load_playbook_data():
     return df_geral, df_indicadores
 
 # =========================================================
-# Lógica operacional (build_playbook_table)
+# Arrays de mercado (cache) e motor por dia
 # =========================================================
-def build_playbook_table(
-    df_geral, df_ind, data_inicio=None, data_fim=None, hora_fim=time(17, 45),
-    alvos_config=None, pts_stop=350, usar_trailing=False,
-    trailing_trigger=300, trailing_dist=300, dias_semana_selecionados=None
-):
-    if alvos_config is None or len(alvos_config) == 0:
-        alvos_config = [{"alvo": 1, "alvo_pts": 0, "qtd": 1}]
-    
-    if dias_semana_selecionados is None:
-        dias_semana_selecionados = [0, 1, 2, 3, 4, 5, 6]
+# Geral + Indicadores viram arrays numpy contíguos, com os boxes de cada dia em
+# sequência (layout CSR: o dia d ocupa as posições inicio[d]:inicio[d+1]).
+# Classificação/entrada e saídas trabalham só sobre esses arrays.
+ENTRADAS = np.array(["", "Compra", "Venda", "Não encontrado"], dtype=object)
+ENT_NENHUMA, ENT_COMPRA, ENT_VENDA, ENT_NAO_ENCONTRADO = 0, 1, 2, 3
+VALOR_PONTO = 0.2
 
+@st.cache_data
+def preparar_arrays_mercado(df_geral, df_ind, hora_fim=time(17, 45)):
     df = df_geral.copy()
     ind = df_ind.copy()
     df["Data"] = pd.to_datetime(df["Data"]).dt.date
@@ -104,212 +186,323 @@ def build_playbook_table(
     ind = ind.rename(columns={"Dia": "Data", "Mínima Injusta": "MinInj", "Máxima Injusta": "MaxInj"})
     df = df.merge(ind, on="Data", how="left")
     df = df.sort_values(["Data", "Box"]).reset_index(drop=True)
-
-    if data_inicio is not None:
-        df = df[df["Data"] >= data_inicio]
-    if data_fim is not None:
-        df = df[df["Data"] <= data_fim]
-        
-    df["_dia_semana"] = pd.to_datetime(df["Data"]).dt.dayofweek
-    df = df[df["_dia_semana"].isin(dias_semana_selecionados)].copy()
-    df = df.drop(columns=["_dia_semana"])
-    df = df[df["Hora"] <= hora_fim].copy()
-
-    if df.empty:
-        return pd.DataFrame()
-
-    df["AbertDia"] = df.groupby("Data")["Abert"].transform("first")
-    df["Lado"] = np.where(df["Fec"] > df["Abert"], "Alta", np.where(df["Fec"] < df["Abert"], "Baixa", "Neutro"))
-
-    linhas_saida = []
-
-    for data_dia, df_day in df.groupby("Data"):
-        df_day = df_day.sort_values("Box").reset_index(drop=True)
-        row_box1 = df_day[df_day["Box"] == 1]
-        if row_box1.empty: row_box1 = df_day.iloc[[0]]
-        row_box1 = row_box1.iloc[0]
-
-        vah = float(row_box1["VAH"]) if not pd.isna(row_box1["VAH"]) else math.nan
-        val = float(row_box1["VAL"]) if not pd.isna(row_box1["VAL"]) else math.nan
-        min_inj = float(row_box1["MinInj"]) if not pd.isna(row_box1["MinInj"]) else math.nan
-        max_inj = float(row_box1["MaxInj"]) if not pd.isna(row_box1["MaxInj"]) else math.nan
-        abrir = float(row_box1["Abert"])
-        abert_dia = float(row_box1["AbertDia"])
-
-        if not math.isnan(min_inj) and abrir <= min_inj: cenario = 4
-        elif not math.isnan(max_inj) and abrir >= max_inj: cenario = 5
-        elif not math.isnan(val) and not math.isnan(vah) and val <= abrir <= vah: cenario = 1
-        elif not math.isnan(val) and not math.isnan(min_inj) and min_inj < abrir < val: cenario = 2
-        elif not math.isnan(vah) and not math.isnan(max_inj) and vah < abrir < max_inj: cenario = 3
-        else: cenario = 0
-
-        entrada = ""
-        entrada_box = None
-        entrada_row = None
-        entrada_price = None
-        
-        if cenario == 1:
-            df_after = df_day[df_day["Box"] > row_box1["Box"]]
-            idx_val = df_after[df_after["Mínima"] <= val].index.min() if not math.isnan(val) else None
-            box_val = int(df_after.loc[idx_val, "Box"]) if pd.notna(idx_val) else None
-            
-            idx_vah = df_after[df_after["Máxima"] >= vah].index.min() if not math.isnan(vah) else None
-            box_vah = int(df_after.loc[idx_vah, "Box"]) if pd.notna(idx_vah) else None
-
-            if box_val is None and box_vah is None:
-                entrada = "Não encontrado"; entrada_box = int(row_box1["Box"]); entrada_row = row_box1
+    df = df[df["Hora"] <= hora_fim].reset_index(drop=True)
+
+    datas = df["Data"].to_numpy()
+    novo_dia = np.ones(len(df), dtype=bool)
+    novo_dia[1:] = datas[1:] != datas[:-1]
+    inicio = np.append(np.flatnonzero(novo_dia), len(df)).astype(np.int64)
+    n_dias = len(inicio) - 1
+    dia_row = np.repeat(np.arange(n_dias), np.diff(inicio))
+
+    # Box de referência do dia: o Box 1, ou o primeiro box disponível
+    box = df["Box"].to_numpy()
+    pos_box1 = np.where(box == 1, np.arange(len(df)), len(df))
+    i_box1 = np.minimum.reduceat(pos_box1, inicio[:-1]) if n_dias else np.zeros(0, dtype=np.int64)
+    i_box1 = np.where(i_box1 < inicio[1:], i_box1, inicio[:-1])
+
+    dias = datas[inicio[:-1]]
+    return {
+        "dias": dias, "dias_np": np.array(dias, dtype="datetime64[D]"),
+        "dia_semana": pd.to_datetime(pd.Series(dias, dtype=object)).dt.dayofweek.to_numpy(),
+        "inicio": inicio, "dia_row": dia_row, "i_box1": i_box1,
+        "box": box, "hora": df["Hora"].to_numpy(),
+        "abert": df["Abert"].to_numpy(), "maxima": df["Máxima"].to_numpy(),
+        "minima": df["Mínima"].to_numpy(), "fec": df["Fec"].to_numpy(),
+        "vah": df["VAH"].to_numpy(dtype=float)[i_box1], "val": df["VAL"].to_numpy(dtype=float)[i_box1],
+        "min_inj": df["MinInj"].to_numpy(dtype=float)[i_box1], "max_inj": df["MaxInj"].to_numpy(dtype=float)[i_box1],
+    }
+
+def selecionar_dias(arrays, data_inicio=None, data_fim=None, dias_semana=None):
+    """Índices dos dias dentro do período e dos dias da semana escolhidos."""
+    mask = np.ones(len(arrays["dias"]), dtype=bool)
+    if data_inicio is not None: mask &= arrays["dias_np"] >= np.datetime64(data_inicio, "D")
+    if data_fim is not None: mask &= arrays["dias_np"] <= np.datetime64(data_fim, "D")
+    if dias_semana is not None: mask &= np.isin(arrays["dia_semana"], list(dias_semana))
+    return np.flatnonzero(mask)
+
+def classificar_cenarios(arrays, idx_dias, offsets=(0,), niveis="Todos"):
+    """
+    Cenário 1-5 e entrada de cada dia, vetorizado em (offsets x dias).
+    Offset positivo afasta os níveis da abertura: VAL-N/VAH+N ('VAL/VAH'),
+    Min Inj-N/Max Inj+N ('Injustas') ou os quatro ('Todos').
+    Retorna matrizes (K, D): 'cenario', 'entrada' (código de ENTRADAS) e 'i_entrada' (posição do box de entrada).
+    """
+    off = np.asarray(offsets, dtype=float)[:, None]
+    d_va = off if niveis in ("VAL/VAH", "Todos") else np.zeros_like(off)
+    d_inj = off if niveis in ("Injustas", "Todos") else np.zeros_like(off)
+    val = arrays["val"][None, :] - d_va; vah = arrays["vah"][None, :] + d_va
+    min_inj = arrays["min_inj"][None, :] - d_inj; max_inj = arrays["max_inj"][None, :] + d_inj
+
+    i_box1 = arrays["i_box1"]
+    abrir = arrays["abert"][i_box1].astype(float)[None, :]
+    # Comparações com NaN dão False, igual aos testes de isnan da versão por dia
+    cenario = np.select(
+        [abrir <= min_inj, abrir >= max_inj, (val <= abrir) & (abrir <= vah), (min_inj < abrir) & (abrir < val), (vah < abrir) & (abrir < max_inj)],
+        [4, 5, 1, 2, 3], default=0,
+    )
+
+    # Cenário 1: primeiro box após o Box 1 que toca VAL (compra) ou VAH (venda)
+    inicio = arrays["inicio"]; dia_row = arrays["dia_row"]; n = len(dia_row)
+    depois = arrays["box"] > arrays["box"][i_box1][dia_row]
+    pos = np.arange(n)
+    toca_val = (arrays["minima"][None, :] <= val[:, dia_row]) & depois
+    toca_vah = (arrays["maxima"][None, :] >= vah[:, dia_row]) & depois
+    p_val = np.minimum.reduceat(np.where(toca_val, pos, n), inicio[:-1], axis=1)
+    p_vah = np.minimum.reduceat(np.where(toca_vah, pos, n), inicio[:-1], axis=1)
+
+    c1_compra = (p_val < p_vah); c1_venda = (p_vah < p_val)
+    entrada = np.select(
+        [cenario == 0, np.isin(cenario, (2, 5)), np.isin(cenario, (3, 4)), c1_compra, c1_venda],
+        [ENT_NENHUMA, ENT_COMPRA, ENT_VENDA, ENT_COMPRA, ENT_VENDA], default=ENT_NAO_ENCONTRADO,
+    )
+    i_entrada = np.where(cenario == 1, np.where(c1_compra, p_val, np.where(c1_venda, p_vah, i_box1)), i_box1)
+    return {"cenario": cenario[:, idx_dias], "entrada": entrada[:, idx_dias], "i_entrada": i_entrada[:, idx_dias]}
+
+def simular_saidas(
+    arrays, d, i_entrada, entrada, alvos_config, pts_stop=350, usar_trailing=False,
+    trailing_trigger=300, trailing_dist=300, alvo_boxes=None, resultados=None
+):
+    """
+    Stop/alvos do dia `d` a partir do box de entrada. Retorna (stop_box, alvo_boxes, resultados),
+    com NaN nos alvos não atingidos. `alvo_boxes`/`resultados` podem ser linhas de buffers já alocados.
+    """
+    if alvo_boxes is None: alvo_boxes = [math.nan] * len(alvos_config)
+    if resultados is None: resultados = [0.0] * len(alvos_config)
+    if entrada not in (ENT_COMPRA, ENT_VENDA):
+        return None, alvo_boxes, resultados
+
+    compra = entrada == ENT_COMPRA
+    ini, fim = arrays["inicio"][d], arrays["inicio"][d + 1]
+    box_dia = arrays["box"][ini:fim]
+    box_ent = int(arrays["box"][i_entrada])
+    entrada_price = float(arrays["abert"][i_entrada]) if box_ent == 1 else float(arrays["fec"][i_entrada])
+    j0 = ini + int(np.searchsorted(box_dia, box_ent, side="right"))  # Boxes após a entrada
+    box_pos = arrays["box"][j0:fim]; fec_pos = arrays["fec"][j0:fim]
+    close_price = float(arrays["fec"][fim - 1])
+    stop_price_static = entrada_price - pts_stop if compra else entrada_price + pts_stop
+    stop_box = None
+
+    if not usar_trailing:
+        hits = np.flatnonzero(fec_pos <= stop_price_static if compra else fec_pos >= stop_price_static)
+        if len(hits): stop_box = int(box_pos[hits[0]])
+    else:
+        max_pos = arrays["maxima"][j0:fim].tolist(); min_pos = arrays["minima"][j0:fim].tolist(); box_lst = box_pos.tolist()
+
+    for idx_alvo, cfg in enumerate(alvos_config, start=1):
+        pts = cfg.get("alvo_pts", 0); qtd = cfg.get("qtd", 1)
+        res = 0.0; alvo_box = None
+        if pts <= 0:
+            continue
+
+        if not usar_trailing:
+            target_price = entrada_price + pts if compra else entrada_price - pts
+            hits = np.flatnonzero(fec_pos >= target_price if compra else fec_pos <= target_price)
+            if len(hits): alvo_box = int(box_pos[hits[0]])
+
+            if alvo_box is None and stop_box is None:
+                res = (close_price - entrada_price if compra else entrada_price - close_price) * VALOR_PONTO * qtd
+            elif alvo_box is not None and (stop_box is None or alvo_box < stop_box):
+                res = pts * VALOR_PONTO * qtd
             else:
-                if box_val is not None and (box_vah is None or box_val < box_vah):
-                    entrada = "Compra"; entrada_box = box_val; entrada_row = df_after[df_after["Box"] == box_val].iloc[0]
-                elif box_vah is not None and (box_val is None or box_vah < box_val):
-                    entrada = "Venda"; entrada_box = box_vah; entrada_row = df_after[df_after["Box"] == box_vah].iloc[0]
-                else:
-                    entrada = "Não encontrado"; entrada_box = int(row_box1["Box"]); entrada_row = row_box1
-        elif cenario in (2, 5):
-            entrada = "Compra"; entrada_box = int(row_box1["Box"]); entrada_row = row_box1
-        elif cenario in (3, 4):
-            entrada = "Venda"; entrada_box = int(row_box1["Box"]); entrada_row = row_box1
+                res = -pts_stop * VALOR_PONTO * qtd
         else:
-            entrada = ""; entrada_box = int(row_box1["Box"]); entrada_row = row_box1
-
-        if entrada_row is not None:
-            entrada_price = float(entrada_row["Abert"]) if entrada_box == 1 else float(entrada_row["Fec"])
-
-        df_after_entry = df_day[df_day["Box"] > entrada_box] if entrada_box is not None else df_day.iloc[0:0]
-        stop_box = None; stop_price_static = None; valor_ponto = 0.2
-
-        if entrada in ("Compra", "Venda") and entrada_price is not None:
-            if entrada == "Compra":
-                stop_price_static = (entrada_row["Abert"] if entrada_box == 1 else entrada_row["Fec"]) - pts_stop
-            else:
-                stop_price_static = (entrada_row["Abert"] if entrada_box == 1 else entrada_row["Fec"]) + pts_stop
+            # Lógica Trailing Stop
+            target_price = entrada_price + pts if compra else entrada_price - pts
+            current_stop_val = stop_price_static
+            trade_closed = False
+
+            for curr_high, curr_low, curr_box in zip(max_pos, min_pos, box_lst):
+                if (curr_low <= current_stop_val) if compra else (curr_high >= current_stop_val):
+                    trade_closed = True; stop_box = int(curr_box)
+                    res = (current_stop_val - entrada_price if compra else entrada_price - current_stop_val) * VALOR_PONTO * qtd
+                    break
+
+                if (curr_high >= target_price) if compra else (curr_low <= target_price):
+                    trade_closed = True; alvo_box = int(curr_box)
+                    res = pts * VALOR_PONTO * qtd
+                    break
+
+                if compra:
+                    if (curr_high - entrada_price) >= trailing_trigger:
+                        new_stop = curr_high - trailing_dist
+                        if new_stop > current_stop_val: current_stop_val = new_stop
+                else:
+                    if (entrada_price - curr_low) >= trailing_trigger:
+                        new_stop = curr_low + trailing_dist
+                        if new_stop < current_stop_val: current_stop_val = new_stop
 
-            if not usar_trailing:
-                cond_stop = df_after_entry["Fec"] <= stop_price_static if entrada == "Compra" else df_after_entry["Fec"] >= stop_price_static
-                idx_stop = df_after_entry[cond_stop].index.min()
-                if isinstance(idx_stop, (int, np.integer)): stop_box = int(df_after_entry.loc[idx_stop, "Box"])
+            if not trade_closed:
+                res = (close_price - entrada_price if compra else entrada_price - close_price) * VALOR_PONTO * qtd
 
-        alvo_boxes = {}; resultados = []
+        alvo_boxes[idx_alvo - 1] = math.nan if alvo_box is None else alvo_box; resultados[idx_alvo - 1] = res
 
-        for idx_alvo, cfg in enumerate(alvos_config, start=1):
-            pts = cfg.get("alvo_pts", 0); qtd = cfg.get("qtd", 1)
-            res = 0.0; alvo_box = None
-            
-            if entrada not in ("Compra", "Venda") or entrada_price is None or pts <= 0:
-                alvo_boxes[idx_alvo] = None; resultados.append(0.0); continue
-
-            if not usar_trailing:
-                target_price = (entrada_row["Abert"] if entrada_box == 1 else entrada_row["Fec"]) + pts if entrada == "Compra" else (entrada_row["Abert"] if entrada_box == 1 else entrada_row["Fec"]) - pts
-                cond_target = df_after_entry["Fec"] >= target_price if entrada == "Compra" else df_after_entry["Fec"] <= target_price
-                idx_target = df_after_entry[cond_target].index.min()
-                if isinstance(idx_target, (int, np.integer)): alvo_box = int(df_after_entry.loc[idx_target, "Box"])
-                
-                if alvo_box is None and stop_box is None:
-                    last_row = df_day.iloc[-1]; close_price = float(last_row["Fec"])
-                    res = (close_price - entrada_price if entrada == "Compra" else entrada_price - close_price) * valor_ponto * qtd
-                elif alvo_box is not None and (stop_box is None or alvo_box < stop_box):
-                    res = pts * valor_ponto * qtd
-                else:
-                    res = -pts_stop * valor_ponto * qtd
-            else:
-                # Lógica Trailing Stop
-                target_price = entrada_price + pts if entrada == "Compra" else entrada_price - pts
-                current_stop_val = stop_price_static
-                trade_closed = False
-                
-                for i, row in df_after_entry.iterrows():
-                    curr_high = float(row["Máxima"]); curr_low = float(row["Mínima"]); curr_box = int(row["Box"])
-                    
-                    hit_stop = False; exit_price_sim = 0.0
-                    if entrada == "Compra":
-                        if curr_low <= current_stop_val: hit_stop = True; exit_price_sim = current_stop_val
-                    else:
-                        if curr_high >= current_stop_val: hit_stop = True; exit_price_sim = current_stop_val
-                    
-                    if hit_stop:
-                        trade_closed = True; stop_box = curr_box
-                        res = (exit_price_sim - entrada_price if entrada == "Compra" else entrada_price - exit_price_sim) * valor_ponto * qtd
-                        break
-
-                    hit_target = False
-                    if entrada == "Compra":
-                        if curr_high >= target_price: hit_target = True; exit_price_sim = target_price
-                    else:
-                        if curr_low <= target_price: hit_target = True; exit_price_sim = target_price
-                    
-                    if hit_target:
-                        trade_closed = True; alvo_box = curr_box
-                        res = pts * valor_ponto * qtd
-                        break
-                    
-                    if entrada == "Compra":
-                        if (curr_high - entrada_price) >= trailing_trigger:
-                            new_stop = curr_high - trailing_dist
-                            if new_stop > current_stop_val: current_stop_val = new_stop
-                    else:
-                        if (entrada_price - curr_low) >= trailing_trigger:
-                            new_stop = curr_low + trailing_dist
-                            if new_stop < current_stop_val: current_stop_val = new_stop
+    return stop_box, alvo_boxes, resultados
 
-                if not trade_closed:
-                    last_row = df_day.iloc[-1]; close_price = float(last_row["Fec"])
-                    res = (close_price - entrada_price if entrada == "Compra" else entrada_price - close_price) * valor_ponto * qtd
+def simular_bloco(arrays, tarefas, params):
+    """
+    Saídas de vários dias (linhas de `tarefas`: dia, box de entrada, código da entrada)
+    gravadas direto em buffers colunares: stop (n,), alvos (n, K) e res (n, K).
+    """
+    n = len(tarefas); k = len(params["alvos_config"])
+    stop = np.full(n, np.nan); alvos = np.full((n, k), np.nan); res = np.zeros((n, k))
+    for j, (d, i_ent, cod_entrada) in enumerate(tarefas.tolist()):
+        stop_box, _, _ = simular_saidas(arrays, d, i_ent, cod_entrada, alvo_boxes=alvos[j], resultados=res[j], **params)
+        if stop_box is not None: stop[j] = stop_box
+    return {"stop": stop, "alvos": alvos, "res": res}
 
-            alvo_boxes[idx_alvo] = alvo_box; resultados.append(res)
+# =========================================================
+# Execução em paralelo (shards de dias em processos)
+# =========================================================
+# Os dias são independentes: o período é partido em shards (mês/ano), cada processo
+# simula as saídas do seu shard lendo os arrays de mercado por memória compartilhada
+# (somente leitura) e os resultados voltam na ordem cronológica dos shards.
+CAMPOS_COMPARTILHADOS = ("inicio", "box", "abert", "maxima", "minima", "fec")
+
+def _modulo_playbook():
+    """Este arquivo como módulo importável (no streamlit ele roda como __main__, que o spawn não reimporta)."""
+    if __name__ != "__main__":
+        return sys.modules[__name__]
+    return importlib.import_module(Path(__file__).stem)
+
+@st.cache_resource
+def _pool_processos(n_processos):
+    return ProcessPoolExecutor(max_workers=n_processos, mp_context=mp.get_context("spawn"))
+
+def _simular_shard(specs, tarefas, params):
+    """Roda no worker: anexa os arrays compartilhados e simula as saídas dos dias do shard."""
+    blocos = [shared_memory.SharedMemory(name=nome) for _, nome, _, _ in specs]
+    try:
+        arrays = {campo: np.ndarray(shape, dtype=dtype, buffer=shm.buf) for (campo, _, shape, dtype), shm in zip(specs, blocos)}
+        for arr in arrays.values(): arr.flags.writeable = False  # Outros workers leem os mesmos blocos
+        saidas = simular_bloco(arrays, tarefas, params)
+        del arrays
+        return saidas
+    finally:
+        for shm in blocos: shm.close()
+
+def _janela_compartilhada(arrays, tarefas):
+    """
+    Recorta os arrays só no trecho dos dias pedidos (do primeiro ao último dia das
+    tarefas) e reindexa as tarefas para esse trecho, para não copiar o histórico inteiro.
+    """
+    d0, d1 = int(tarefas[0, 0]), int(tarefas[-1, 0])
+    base, fim = int(arrays["inicio"][d0]), int(arrays["inicio"][d1 + 1])
+    janela = {campo: arrays[campo][base:fim] for campo in CAMPOS_COMPARTILHADOS if campo != "inicio"}
+    janela["inicio"] = arrays["inicio"][d0:d1 + 2] - base
+    tarefas_locais = tarefas.copy()
+    tarefas_locais[:, 0] -= d0; tarefas_locais[:, 1] -= base
+    return janela, tarefas_locais
+
+def simular_saidas_paralelo(arrays, tarefas, dias_np, params, particao="M", n_processos=None):
+    """
+    Mesmo resultado de simular_bloco(arrays, tarefas, params), com os dias
+    partidos por mês ('M') ou ano ('Y') e distribuídos num pool de processos.
+    Se o pool quebrar (worker morto), ele é recriado uma vez; se quebrar de novo, roda sequencial.
+    """
+    n_processos = n_processos or os.cpu_count() or 1
+    chaves = dias_np.astype(f"datetime64[{particao}]")
+    cortes = np.flatnonzero(chaves[1:] != chaves[:-1]) + 1
+    if n_processos <= 1 or len(cortes) == 0:
+        return simular_bloco(arrays, tarefas, params)
+
+    janela, tarefas_locais = _janela_compartilhada(arrays, tarefas)
+    # Shards inteiros agrupados em um lote contíguo por processo: menos idas e voltas ao pool
+    shards = np.split(tarefas_locais, cortes)
+    lotes = [np.concatenate([shards[k] for k in grupo]) for grupo in np.array_split(np.arange(len(shards)), min(n_processos, len(shards)))]
+    blocos = []; specs = []
+    try:
+        for campo in CAMPOS_COMPARTILHADOS:
+            origem = np.ascontiguousarray(janela[campo])
+            shm = shared_memory.SharedMemory(create=True, size=max(origem.nbytes, 1))
+            blocos.append(shm)
+            np.ndarray(origem.shape, dtype=origem.dtype, buffer=shm.buf)[:] = origem
+            specs.append((campo, shm.name, origem.shape, origem.dtype.str))
+
+        modulo = _modulo_playbook()
+        for tentativa in range(2):
+            try:
+                pool = modulo._pool_processos(n_processos)
+                futuros = [pool.submit(modulo._simular_shard, specs, lote, params) for lote in lotes]
+                # Junta na ordem dos lotes (cronológica), independente de qual terminou primeiro
+                partes = [f.result() for f in futuros]
+                return {chave: np.concatenate([p[chave] for p in partes]) for chave in ("stop", "alvos", "res")}
+            except BrokenProcessPool:
+                # Pool em cache ficou inutilizável: descarta para a próxima chamada criar outro
+                pool.shutdown(wait=False, cancel_futures=True)
+                modulo._pool_processos.clear()
+        return simular_bloco(arrays, tarefas, params)
+    finally:
+        for shm in blocos:
+            shm.close(); shm.unlink()
 
-        resultado_total = float(sum(resultados))
-        
-        # --- Adicionando a coluna "Box-Ent" ---
-        linha = {
-            "Data": entrada_row["Data"], "Hora": entrada_row["Hora"], "Abert": entrada_row["Abert"],
-            "Máxima": entrada_row["Máxima"], "Mínima": entrada_row["Mínima"], "Fech": entrada_row["Fec"],
-            "Box": entrada_row["Box"], "Abert. Dia": abert_dia, "VAH": vah, "VAL": val,
-            "Max Inj": max_inj, "Min Inj": min_inj, "Lado": entrada_row["Lado"],
-            "Cenário": cenario, "Entrada": entrada, 
-            "Box-Ent": entrada_box, # NOVA COLUNA AQUI
-            "Stop": stop_box, "Resultado Total": resultado_total
-        }
-        for i in range(1, len(alvos_config) + 1):
-            linha[f"Alvo-{i}"] = alvo_boxes.get(i)
-            linha[f"Add-{i}"] = cfg.get("qtd", 1) if entrada in ("Compra", "Venda") else 0
-            linha[f"Res-{i}"] = resultados[i-1]
-        linhas_saida.append(linha)
-
-    if not linhas_saida: return pd.DataFrame()
-    resultado_df = pd.DataFrame(linhas_saida)
-    
-    # Colunas e Ordem
-    cols_base = ["Data", "Hora", "Abert", "Máxima", "Mínima", "Fech", "Box", "Abert. Dia", "VAH", "VAL", "Max Inj", "Min Inj", "Lado", "Cenário", "Entrada", "Box-Ent"]
-    cols_alvo = [f"Alvo-{i}" for i in range(1, len(alvos_config) + 1)]
-    cols_add = [f"Add-{i}" for i in range(1, len(alvos_config) + 1)]
-    cols_res = [f"Res-{i}" for i in range(1, len(alvos_config) + 1)]
-    cols = cols_base + cols_alvo + ["Stop"] + cols_add + cols_res + ["Resultado Total"]
+# =========================================================
+# Lógica operacional (build_playbook_table)
+# =========================================================
+@st.cache_data
+def build_playbook_table(
+    df_geral, df_ind, data_inicio=None, data_fim=None, hora_fim=time(17, 45),
+    alvos_config=None, pts_stop=350, usar_trailing=False,
+    trailing_trigger=300, trailing_dist=300, dias_semana_selecionados=None,
+    paralelo=False, particao="M", n_processos=None
+):
+    if alvos_config is None or len(alvos_config) == 0:
+        alvos_config = [{"alvo": 1, "alvo_pts": 0, "qtd": 1}]
     
-    cols_existentes = [c for c in cols if c in resultado_df.columns]
-    resultado_df = resultado_df[cols_existentes]
-
+    if dias_semana_selecionados is None:
+        dias_semana_selecionados = [0, 1, 2, 3, 4, 5, 6]
 
-    # --- CÁLCULO DO ACUMULADO MENSAL (Dia-Dia) ---
-    if "Resultado Total" in resultado_df.columns:
-        resultado_df["Data"] = pd.to_datetime(resultado_df["Data"])
-        resultado_df = resultado_df.sort_values(by=["Data", "Hora"], ascending=True)
-        resultado_df["MesAno"] = resultado_df["Data"].dt.to_period("M")
-        resultado_df["Dia-Dia"] = resultado_df.groupby("MesAno")["Resultado Total"].cumsum()
-        resultado_df = resultado_df.drop(columns=["MesAno"])
-        
-        cols_finais = list(resultado_df.columns)
-        if "Resultado Total" in cols_finais and "Dia-Dia" in cols_finais:
-            cols_finais.remove("Dia-Dia")
-            idx = cols_finais.index("Resultado Total")
-            cols_finais.insert(idx + 1, "Dia-Dia")
-        resultado_df = resultado_df[cols_finais]
+    arrays = preparar_arrays_mercado(df_geral, df_ind, hora_fim)
+    idx_dias = selecionar_dias(arrays, data_inicio, data_fim, dias_semana_selecionados)
+    if len(idx_dias) == 0:
+        return pd.DataFrame()
 
-    resultado_df = resultado_df.sort_values(["Data", "Hora"], ascending=[False, False]).reset_index(drop=True)
-    return resultado_df
+    cls = classificar_cenarios(arrays, idx_dias)
+    cenario = cls["cenario"][0]; cod_entrada = cls["entrada"][0]; i_ent = cls["i_entrada"][0]
+    tarefas = np.column_stack([idx_dias, i_ent, cod_entrada]).astype(np.int64)
+    params = {"alvos_config": alvos_config, "pts_stop": pts_stop, "usar_trailing": usar_trailing,
+              "trailing_trigger": trailing_trigger, "trailing_dist": trailing_dist}
+    if paralelo:
+        saidas = simular_saidas_paralelo(arrays, tarefas, arrays["dias_np"][idx_dias], params, particao, n_processos)
+    else:
+        saidas = simular_bloco(arrays, tarefas, params)
+
+    # --- Montagem colunar: cada coluna é um array do tamanho do nº de dias ---
+    # Os dias saem de selecionar_dias em ordem cronológica (um por linha), então a
+    # ordem final (mais recente primeiro) é só inverter, sem ordenar de novo.
+    ordem = np.arange(len(idx_dias))[::-1]
+    dias = idx_dias[ordem]; ent = i_ent[ordem]; cod = cod_entrada[ordem]
+    res = saidas["res"][ordem]
+    abert_ent = arrays["abert"][ent]; fec_ent = arrays["fec"][ent]
+    em_posicao = (cod == ENT_COMPRA) | (cod == ENT_VENDA)
+
+    resultado_total = np.zeros(len(ordem))
+    for i in range(len(alvos_config)): resultado_total += res[:, i]  # Mesma ordem de soma do sum() por linha
+    datas = pd.to_datetime(arrays["dias_np"][dias])
+    dia_dia = pd.Series(resultado_total[::-1]).groupby(datas[::-1].to_period("M")).cumsum().to_numpy()[::-1]
+
+    colunas = {
+        "Data": datas, "Hora": arrays["hora"][ent], "Abert": abert_ent,
+        "Máxima": arrays["maxima"][ent], "Mínima": arrays["minima"][ent], "Fech": fec_ent,
+        "Box": arrays["box"][ent], "Abert. Dia": arrays["abert"][arrays["inicio"][dias]].astype(float),
+        "VAH": arrays["vah"][dias], "VAL": arrays["val"][dias], "Max Inj": arrays["max_inj"][dias], "Min Inj": arrays["min_inj"][dias],
+        "Lado": np.where(fec_ent > abert_ent, "Alta", np.where(fec_ent < abert_ent, "Baixa", "Neutro")),
+        "Cenário": cenario[ordem], "Entrada": ENTRADAS[cod],
+        "Box-Ent": arrays["box"][ent],
+    }
+    for i in range(len(alvos_config)): colunas[f"Alvo-{i+1}"] = saidas["alvos"][ordem, i]
+    colunas["Stop"] = saidas["stop"][ordem]
+    # Add-i repete a qtd do último alvo (a mesma regra da tabela original)
+    for i in range(len(alvos_config)): colunas[f"Add-{i+1}"] = np.where(em_posicao, alvos_config[-1].get("qtd", 1), 0)
+    for i in range(len(alvos_config)): colunas[f"Res-{i+1}"] = res[:, i]
+    colunas["Resultado Total"] = resultado_total
+    # --- ACUMULADO MENSAL (Dia-Dia) ---
+    colunas["Dia-Dia"] = dia_dia
+
+    return pd.DataFrame(colunas)
 
 def format_playbook_table_for_display(tabela: pd.DataFrame):
-    df = tabela.copy()
-    df = df.reset_index(drop=True)
+    df = tabela.reset_index(drop=True)
     
     price_cols = ["Abert", "Máxima", "Mínima", "Fech", "Abert. Dia", "VAH", "VAL", "Max Inj", "Min Inj"]
     
@@ -318,37 +511,448 @@ def format_playbook_table_for_display(tabela: pd.DataFrame):
     if "Box-Ent" in df.columns: box_cols.append("Box-Ent")
     
     res_cols = [c for c in df.columns if c.startswith("Res-")] + (["Resultado Total", "Dia-Dia"] if "Resultado Total" in df.columns else [])
+
+    textos = {}; classes = {}
+    for col in df.columns:
+        if col == "Data": textos[col] = fmt_data_col(df[col])
+        elif col in price_cols: textos[col] = fmt_price_col(df[col])
+        elif col in box_cols: textos[col] = fmt_box_col(df[col])
+        elif col in res_cols:
+            textos[col] = fmt_res_col(df[col]); classes[col] = classe_res_col(df[col])
+        else: textos[col] = fmt_texto_col(df[col])
+
+    if "Lado" in df.columns: classes["Lado"] = classe_mapa_col(df["Lado"], {"Alta": "lado-alta", "Baixa": "lado-baixa"})
+    if "Entrada" in df.columns: classes["Entrada"] = classe_mapa_col(df["Entrada"], {"Compra": "ent-compra", "Venda": "ent-venda"})
     
-    for col in price_cols: 
-        if col in df.columns: df[col] = pd.to_numeric(df[col], errors="coerce")
-    for col in box_cols: 
-        if col in df.columns: df[col] = pd.to_numeric(df[col], errors="coerce")
-    for col in res_cols: 
-        if col in df.columns: df[col] = pd.to_numeric(df[col], errors="coerce")
-
-    styler = df.style
-    fmt_dict = {}
-    if "Data" in df.columns: fmt_dict["Data"] = fmt_data
-    for col in price_cols: 
-        if col in df.columns: fmt_dict[col] = fmt_price
-    for col in box_cols: 
-        if col in df.columns: fmt_dict[col] = fmt_box
-    for col in res_cols: 
-        if col in df.columns: fmt_dict[col] = fmt_res
-
-    styler = styler.format(fmt_dict, na_rep="")
-
-    def color_lado(v): return "color: #22c55e;" if v == "Alta" else "color: #ef4444;" if v == "Baixa" else "color: #e5e7eb;"
-    def color_entrada(v): return "color: #3b82f6;" if v == "Compra" else "color: #d946ef;" if v == "Venda" else "color: #e5e7eb;"
-
-    if "Lado" in df.columns: styler = styler.map(color_lado, subset=["Lado"])
-    if "Entrada" in df.columns: styler = styler.map(color_entrada, subset=["Entrada"])
-    
-    exist_res = [c for c in res_cols if c in df.columns]
-    if exist_res: styler = styler.map(color_res, subset=exist_res)
-    
-    styler = styler.hide(axis="index")
-    return styler.to_html(escape=False)
+    return tabela_html(textos, classes)
+
+# =========================================================
+# Sweep de offsets nos níveis (sensibilidade dos cenários)
+# =========================================================
+@st.cache_data
+def sweep_offsets(
+    df_geral, df_ind, offsets, niveis="Todos", data_inicio=None, data_fim=None, hora_fim=time(17, 45),
+    alvos_config=None, pts_stop=350, usar_trailing=False,
+    trailing_trigger=300, trailing_dist=300, dias_semana_selecionados=None
+):
+    """
+    Refaz só classificação + entrada para cada offset (todos os dias de uma vez) e
+    reaproveita as saídas: dias cuja entrada não muda com o offset não são resimulados.
+    """
+    if alvos_config is None or len(alvos_config) == 0:
+        alvos_config = [{"alvo": 1, "alvo_pts": 0, "qtd": 1}]
+    offsets = list(offsets)
+    arrays = preparar_arrays_mercado(df_geral, df_ind, hora_fim)
+    idx_dias = selecionar_dias(arrays, data_inicio, data_fim, dias_semana_selecionados)
+    if len(idx_dias) == 0 or not offsets:
+        return pd.DataFrame()
+
+    cls = classificar_cenarios(arrays, idx_dias, offsets, niveis)
+    saidas = {}  # (dia, box de entrada, sentido) -> resultado total
+    linhas = []
+
+    for k, offset in enumerate(offsets):
+        res = np.zeros(len(idx_dias))
+        for j, d in enumerate(idx_dias):
+            chave = (d, int(cls["i_entrada"][k, j]), int(cls["entrada"][k, j]))
+            if chave[2] not in (ENT_COMPRA, ENT_VENDA):
+                continue
+            if chave not in saidas:
+                _, _, resultados = simular_saidas(arrays, d, chave[1], chave[2], alvos_config, pts_stop, usar_trailing, trailing_trigger, trailing_dist)
+                saidas[chave] = float(sum(resultados))
+            res[j] = saidas[chave]
+
+        cenarios = np.bincount(cls["cenario"][k], minlength=6)
+        entradas = np.bincount(cls["entrada"][k], minlength=len(ENTRADAS))
+        acum = np.cumsum(res)
+        ganhos = res[res > 0].sum(); perdas = res[res < 0].sum()
+        linha = {"Offset": offset}
+        linha.update({f"Cen. {c}": int(cenarios[c]) for c in range(6)})
+        linha.update({
+            "Compras": int(entradas[ENT_COMPRA]), "Vendas": int(entradas[ENT_VENDA]), "Não encontrado": int(entradas[ENT_NAO_ENCONTRADO]),
+            "Resultado Total": float(res.sum()), "Taxa Acerto": float((res > 0).sum() / len(res)),
+            "Fator de Lucro": float(ganhos / abs(perdas)) if perdas != 0 else 0.0,
+            "Drawdown Máximo": float((acum - np.maximum.accumulate(acum)).min()),
+        })
+        linhas.append(linha)
+
+    return pd.DataFrame(linhas)
+
+# =========================================================
+# Cubo de estatísticas (uma passada sobre as operações)
+# =========================================================
+# Cada célula guarda somas parciais aditivas no menor grão (Ano, Mês, Dia Semana,
+# Cenário, Entrada); qualquer fatia ou total sai somando células, sem reler a tabela.
+# Métricas de trajetória (acumulado mínimo, drawdown) não são aditivas e só existem
+# na série mensal da carteira inteira: as operações de uma célula (ex.: Cenário 1 às
+# segundas) não são contíguas no tempo, então não dá para encadeá-las. Cada mês guarda
+# (soma, acum. mín, acum. máx, drawdown) e meses consecutivos são encadeados por
+# _encadear_trajetorias para chegar ao ano ou ao total.
+DIMENSOES_CUBO = ["Ano", "Mês", "Dia Semana", "Cenário", "Entrada"]
+SOMAS_CUBO = ["Trades", "Resultado Total", "Soma Quad", "Ganhos Brutos", "Perdas Brutas", "Dias (+)", "Dias (-)"]
+
+def _trajetoria_por_grupo(res, codigos, n_grupos):
+    """Acumulado mín/máx e drawdown de cada grupo, seguindo a ordem das linhas."""
+    s = pd.Series(res)
+    acum = s.groupby(codigos).cumsum()
+    dd = acum - acum.groupby(codigos).cummax()
+    acum_min = np.full(n_grupos, np.inf); np.minimum.at(acum_min, codigos, acum.to_numpy())
+    acum_max = np.full(n_grupos, -np.inf); np.maximum.at(acum_max, codigos, acum.to_numpy())
+    dd_min = np.zeros(n_grupos); np.minimum.at(dd_min, codigos, dd.to_numpy())
+    return acum_min, acum_max, dd_min
+
+def _encadear_trajetorias(trechos):
+    """Combina trechos em ordem cronológica: (soma, acum_min, acum_max, drawdown)."""
+    total, acum_min, acum_max, dd = 0.0, math.inf, -math.inf, 0.0
+    for soma, t_min, t_max, t_dd in trechos:
+        dd = min(dd, t_dd, total + t_min - acum_max)
+        acum_min = min(acum_min, total + t_min)
+        acum_max = max(acum_max, total + t_max)
+        total += soma
+    return total, acum_min, acum_max, dd
+
+def build_stats_cube(tabela: pd.DataFrame):
+    """Monta o cubo {'celulas', 'mensal'} a partir da tabela do build_playbook_table."""
+    df = tabela.sort_values(["Data", "Hora"]) if "Hora" in tabela.columns else tabela.sort_values("Data")
+    datas = pd.to_datetime(df["Data"])
+    res = df["Resultado Total"].to_numpy(dtype=float)
+    chaves = pd.DataFrame({
+        "Ano": datas.dt.year.to_numpy(), "Mês": datas.dt.month.to_numpy(), "Dia Semana": datas.dt.dayofweek.to_numpy(),
+        "Cenário": df["Cenário"].to_numpy(), "Entrada": df["Entrada"].astype(str).to_numpy(),
+    })
+
+    codigos, indice = pd.MultiIndex.from_frame(chaves).factorize()
+    indice = indice.set_names(DIMENSOES_CUBO); n = len(indice)
+    pos = res > 0; neg = res < 0
+    celulas = pd.DataFrame({
+        "Trades": np.bincount(codigos, minlength=n),
+        "Resultado Total": np.bincount(codigos, weights=res, minlength=n),
+        "Soma Quad": np.bincount(codigos, weights=res * res, minlength=n),
+        "Ganhos Brutos": np.bincount(codigos, weights=np.where(pos, res, 0.0), minlength=n),
+        "Perdas Brutas": np.bincount(codigos, weights=np.where(neg, res, 0.0), minlength=n),
+        "Dias (+)": np.bincount(codigos, weights=pos, minlength=n).astype(int),
+        "Dias (-)": np.bincount(codigos, weights=neg, minlength=n).astype(int),
+    }, index=indice)
+
+    # Espinha temporal: mesmo sweep agrupado só por mês (linhas já em ordem cronológica)
+    codigos_mes, indice_mes = pd.MultiIndex.from_frame(chaves[["Ano", "Mês"]]).factorize()
+    indice_mes = indice_mes.set_names(["Ano", "Mês"]); n_mes = len(indice_mes)
+    mensal = pd.DataFrame({"Resultado Total": np.bincount(codigos_mes, weights=res, minlength=n_mes)}, index=indice_mes)
+    mensal["Acum Min"], mensal["Acum Max"], mensal["Drawdown"] = _trajetoria_por_grupo(res, codigos_mes, n_mes)
+
+    return {"celulas": celulas.sort_index(), "mensal": mensal.sort_index()}
+
+def cube_rollup(cubo, dims=None):
+    """Soma as células do cubo nas dimensões pedidas (None/[] = total geral) e deriva as métricas."""
+    somas = cubo["celulas"][SOMAS_CUBO]
+    agg = somas.groupby(level=list(dims)).sum() if dims else somas.sum().to_frame("Total").T
+    agg[["Trades", "Dias (+)", "Dias (-)"]] = agg[["Trades", "Dias (+)", "Dias (-)"]].astype(int)
+
+    n = agg["Trades"].astype(float)
+    agg["Taxa Acerto"] = (agg["Dias (+)"] / n.replace(0, np.nan)).fillna(0)
+    agg["Fator de Lucro"] = (agg["Ganhos Brutos"] / agg["Perdas Brutas"].abs().replace(0, 1)).fillna(0)
+    agg["Média/Dia"] = agg["Resultado Total"] / n.replace(0, np.nan)
+    agg["Média Gain"] = agg["Ganhos Brutos"] / agg["Dias (+)"].replace(0, np.nan)
+    agg["Média Loss"] = agg["Perdas Brutas"] / agg["Dias (-)"].replace(0, np.nan)
+    agg["Payoff"] = agg["Média Gain"].abs() / agg["Média Loss"].abs()
+    # Desvio padrão amostral (ddof=1) a partir de n, soma e soma dos quadrados
+    var = (agg["Soma Quad"] - agg["Resultado Total"] ** 2 / n) / (n - 1).where(n > 1)
+    agg["Volatilidade"] = np.sqrt(var.clip(lower=0))
+    return agg
+
+def cube_trajetoria(cubo, nivel="Total"):
+    """Encadeia os meses em ordem: nivel 'Mês', 'Ano' ou 'Total'."""
+    mensal = cubo["mensal"]
+    if nivel == "Mês":
+        return mensal
+    cols = ["Resultado Total", "Acum Min", "Acum Max", "Drawdown"]
+    grupos = mensal.groupby(level="Ano") if nivel == "Ano" else [("Total", mensal)]
+    linhas = {chave: _encadear_trajetorias(g[cols].itertuples(index=False, name=None)) for chave, g in grupos}
+    return pd.DataFrame.from_dict(linhas, orient="index", columns=cols)
+
+# =========================================================
+# Modo Ao Vivo (atualização incremental do dia corrente)
+# =========================================================
+# Mesmas regras do build_playbook_table, mas avaliadas box a box: cada box novo
+# custa O(qtde. alvos), sem reprocessar o histórico nem o próprio dia.
+
+def iniciar_estado_ao_vivo(
+    df_ind, data_dia, hora_fim=time(17, 45), alvos_config=None, pts_stop=350,
+    usar_trailing=False, trailing_trigger=300, trailing_dist=300
+):
+    """Cria o estado vazio do dia, com os níveis (VAH/VAL/Injustas) da aba Indicadores."""
+    if alvos_config is None or len(alvos_config) == 0:
+        alvos_config = [{"alvo": 1, "alvo_pts": 0, "qtd": 1}]
+
+    ind_dia = df_ind[pd.to_datetime(df_ind["Dia"]).dt.date == data_dia]
+    niveis = {"VAH": math.nan, "VAL": math.nan, "MinInj": math.nan, "MaxInj": math.nan}
+    if not ind_dia.empty:
+        row_ind = ind_dia.iloc[0]
+        for chave, col in (("VAH", "VAH"), ("VAL", "VAL"), ("MinInj", "Mínima Injusta"), ("MaxInj", "Máxima Injusta")):
+            niveis[chave] = float(row_ind[col]) if not pd.isna(row_ind[col]) else math.nan
+
+    return {
+        "data": data_dia, "hora_fim": hora_fim, "pts_stop": pts_stop, "valor_ponto": VALOR_PONTO,
+        "usar_trailing": usar_trailing, "trailing_trigger": trailing_trigger, "trailing_dist": trailing_dist,
+        "tem_indicadores": not ind_dia.empty, **niveis,
+        "box1": None, "ultimo": None, "cenario": None,
+        "entrada": "", "entrada_row": None, "entrada_box": None, "entrada_price": None,
+        "stop_price": None, "stop_box": None,
+        "alvos": [
+            {"pts": cfg.get("alvo_pts", 0), "qtd": cfg.get("qtd", 1), "target_price": None,
+             "stop_atual": None, "alvo_box": None, "fechado": False, "res": 0.0}
+            for cfg in alvos_config
+        ],
+    }
+
+def _abrir_posicao_ao_vivo(estado, entrada, row):
+    estado["entrada"] = entrada; estado["entrada_row"] = row; estado["entrada_box"] = int(row["Box"])
+    if entrada not in ("Compra", "Venda"):
+        return
+    preco = float(row["Abert"]) if int(row["Box"]) == 1 else float(row["Fec"])
+    estado["entrada_price"] = preco
+    estado["stop_price"] = preco - estado["pts_stop"] if entrada == "Compra" else preco + estado["pts_stop"]
+    for alvo in estado["alvos"]:
+        if alvo["pts"] <= 0:
+            alvo["fechado"] = True; continue
+        alvo["target_price"] = preco + alvo["pts"] if entrada == "Compra" else preco - alvo["pts"]
+        alvo["stop_atual"] = estado["stop_price"]
+
+def _atualizar_saidas_ao_vivo(estado, row):
+    entrada = estado["entrada"]; preco = estado["entrada_price"]; vp = estado["valor_ponto"]
+    fec = float(row["Fec"]); curr_high = float(row["Máxima"]); curr_low = float(row["Mínima"]); curr_box = int(row["Box"])
+
+    if not estado["usar_trailing"]:
+        # Stop e alvos olham o fechamento do box; o primeiro evento encerra cada alvo
+        for alvo in estado["alvos"]:
+            if alvo["pts"] <= 0 or alvo["alvo_box"] is not None:
+                continue
+            if (fec >= alvo["target_price"]) if entrada == "Compra" else (fec <= alvo["target_price"]):
+                alvo["alvo_box"] = curr_box
+                if not alvo["fechado"]:
+                    alvo["fechado"] = True; alvo["res"] = alvo["pts"] * vp * alvo["qtd"]
+        if estado["stop_box"] is None and ((fec <= estado["stop_price"]) if entrada == "Compra" else (fec >= estado["stop_price"])):
+            estado["stop_box"] = curr_box
+            for alvo in estado["alvos"]:
+                if not alvo["fechado"]:
+                    alvo["fechado"] = True; alvo["res"] = -estado["pts_stop"] * vp * alvo["qtd"]
+        return
+
+    # Lógica Trailing Stop (cada alvo carrega o seu próprio stop móvel)
+    for alvo in estado["alvos"]:
+        if alvo["fechado"]:
+            continue
+        stop_atual = alvo["stop_atual"]
+        if (curr_low <= stop_atual) if entrada == "Compra" else (curr_high >= stop_atual):
+            alvo["fechado"] = True; estado["stop_box"] = curr_box
+            alvo["res"] = (stop_atual - preco if entrada == "Compra" else preco - stop_atual) * vp * alvo["qtd"]
+            continue
+        if (curr_high >= alvo["target_price"]) if entrada == "Compra" else (curr_low <= alvo["target_price"]):
+            alvo["fechado"] = True; alvo["alvo_box"] = curr_box
+            alvo["res"] = alvo["pts"] * vp * alvo["qtd"]
+            continue
+        if entrada == "Compra":
+            if (curr_high - preco) >= estado["trailing_trigger"]:
+                alvo["stop_atual"] = max(stop_atual, curr_high - estado["trailing_dist"])
+        else:
+            if (preco - curr_low) >= estado["trailing_trigger"]:
+                alvo["stop_atual"] = min(stop_atual, curr_low + estado["trailing_dist"])
+
+def atualizar_estado_ao_vivo(estado, row):
+    """Aplica um novo box (dict com Data, Hora, Abert, Máxima, Mínima, Fec, Box) ao estado do dia."""
+    if row["Data"] != estado["data"] or row["Hora"] > estado["hora_fim"]:
+        return False
+    if estado["ultimo"] is not None and int(row["Box"]) <= int(estado["ultimo"]["Box"]):
+        return False  # Box repetido ou fora de ordem
+    row = dict(row)
+    row["Lado"] = "Alta" if row["Fec"] > row["Abert"] else "Baixa" if row["Fec"] < row["Abert"] else "Neutro"
+    estado["ultimo"] = row
+
+    if estado["box1"] is None:
+        estado["box1"] = row
+        abrir = float(row["Abert"])
+        val, vah, min_inj, max_inj = estado["VAL"], estado["VAH"], estado["MinInj"], estado["MaxInj"]
+        if not math.isnan(min_inj) and abrir <= min_inj: cenario = 4
+        elif not math.isnan(max_inj) and abrir >= max_inj: cenario = 5
+        elif not math.isnan(val) and not math.isnan(vah) and val <= abrir <= vah: cenario = 1
+        elif not math.isnan(val) and not math.isnan(min_inj) and min_inj < abrir < val: cenario = 2
+        elif not math.isnan(vah) and not math.isnan(max_inj) and vah < abrir < max_inj: cenario = 3
+        else: cenario = 0
+        estado["cenario"] = cenario
+
+        if cenario in (2, 5): _abrir_posicao_ao_vivo(estado, "Compra", row)
+        elif cenario in (3, 4): _abrir_posicao_ao_vivo(estado, "Venda", row)
+        elif cenario == 0: _abrir_posicao_ao_vivo(estado, "", row)
+        return True
+
+    if estado["cenario"] == 1 and estado["entrada_box"] is None:
+        toca_val = not math.isnan(estado["VAL"]) and float(row["Mínima"]) <= estado["VAL"]
+        toca_vah = not math.isnan(estado["VAH"]) and float(row["Máxima"]) >= estado["VAH"]
+        if toca_val and toca_vah: _abrir_posicao_ao_vivo(estado, "Não encontrado", estado["box1"])
+        elif toca_val: _abrir_posicao_ao_vivo(estado, "Compra", row)
+        elif toca_vah: _abrir_posicao_ao_vivo(estado, "Venda", row)
+        return True
+
+    if estado["entrada"] in ("Compra", "Venda"):
+        _atualizar_saidas_ao_vivo(estado, row)
+    return True
+
+def linha_estado_ao_vivo(estado):
+    """Retorna o sinal do dia no mesmo layout de colunas do build_playbook_table."""
+    if estado["box1"] is None:
+        return pd.DataFrame()
+
+    entrada = estado["entrada"]; entrada_row = estado["entrada_row"]
+    if estado["cenario"] == 1 and estado["entrada_box"] is None:
+        entrada = "Aguardando"; entrada_row = estado["box1"]
+    em_posicao = entrada in ("Compra", "Venda")
+
+    # Alvos ainda abertos são marcados a mercado pelo último fechamento (igual ao fim do dia no histórico)
+    close_price = float(estado["ultimo"]["Fec"]); preco = estado["entrada_price"]
+    resultados = []
+    for alvo in estado["alvos"]:
+        if not em_posicao or alvo["pts"] <= 0: resultados.append(0.0)
+        elif alvo["fechado"]: resultados.append(alvo["res"])
+        else: resultados.append((close_price - preco if entrada == "Compra" else preco - close_price) * estado["valor_ponto"] * alvo["qtd"])
+
+    linha = {
+        "Data": entrada_row["Data"], "Hora": entrada_row["Hora"], "Abert": entrada_row["Abert"],
+        "Máxima": entrada_row["Máxima"], "Mínima": entrada_row["Mínima"], "Fech": entrada_row["Fec"],
+        "Box": entrada_row["Box"], "Abert. Dia": float(estado["box1"]["Abert"]), "VAH": estado["VAH"], "VAL": estado["VAL"],
+        "Max Inj": estado["MaxInj"], "Min Inj": estado["MinInj"], "Lado": entrada_row["Lado"],
+        "Cenário": estado["cenario"], "Entrada": entrada,
+        "Box-Ent": estado["entrada_box"] if estado["entrada_box"] is not None else int(estado["box1"]["Box"]),
+        "Stop": estado["stop_box"], "Resultado Total": float(sum(resultados))
+    }
+    for i, alvo in enumerate(estado["alvos"], start=1):
+        linha[f"Alvo-{i}"] = alvo["alvo_box"]
+        linha[f"Add-{i}"] = estado["alvos"][-1]["qtd"] if em_posicao else 0  # mesma regra do build_playbook_table
+        linha[f"Res-{i}"] = resultados[i-1]
+
+    n = len(estado["alvos"])
+    cols = ["Data", "Hora", "Abert", "Máxima", "Mínima", "Fech", "Box", "Abert. Dia", "VAH", "VAL", "Max Inj", "Min Inj", "Lado", "Cenário", "Entrada", "Box-Ent"]
+    cols += [f"Alvo-{i}" for i in range(1, n + 1)] + ["Stop"] + [f"Add-{i}" for i in range(1, n + 1)] + [f"Res-{i}" for i in range(1, n + 1)] + ["Resultado Total"]
+    return pd.DataFrame([linha])[cols]
+
+# --- Leitura do feed (CSV local ou socket TCP, uma linha por box) ---
+COLUNAS_FEED = ["Data", "Hora", "Abert", "Máxima", "Mínima", "Fec", "Box"]
+
+def parse_linha_feed(linha):
+    """Converte 'Data;Hora;Abert;Máxima;Mínima;Fec;Box' (ou separado por vírgula) em dict. Cabeçalho/lixo -> None."""
+    linha = linha.strip()
+    if not linha:
+        return None
+    partes = [p.strip() for p in linha.split(";" if ";" in linha else ",")]
+    if len(partes) < len(COLUNAS_FEED):
+        return None
+    try:
+        dia = None
+        for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y"):
+            try:
+                dia = datetime.strptime(partes[0][:10], fmt).date(); break
+            except ValueError:
+                continue
+        if dia is None:
+            return None
+        hora = datetime.strptime(partes[1], "%H:%M:%S" if partes[1].count(":") == 2 else "%H:%M").time()
+        abert, maxima, minima, fec = (float(p.replace(",", ".")) for p in partes[2:6])
+        box = int(float(partes[6].replace(",", ".")))
+    except ValueError:
+        return None
+    return {"Data": dia, "Hora": hora, "Abert": abert, "Máxima": maxima, "Mínima": minima, "Fec": fec, "Box": box}
+
+def ler_feed_csv(caminho, offset=0):
+    """Lê só as linhas completas gravadas após `offset` (em bytes). Retorna (boxes, novo_offset)."""
+    caminho = Path(caminho)
+    if not caminho.exists():
+        raise FileNotFoundError(f"Não encontrei o feed '{caminho}'.")
+    if caminho.stat().st_size < offset:
+        offset = 0  # Arquivo truncado/rotacionado: recomeça do início
+    with open(caminho, "rb") as f:
+        f.seek(offset)
+        bruto = f.read()
+    fim = bruto.rfind(b"\n") + 1  # Linha ainda sendo escrita fica para a próxima leitura
+    boxes = [b for b in (parse_linha_feed(l) for l in bruto[:fim].decode("utf-8-sig", errors="ignore").splitlines()) if b is not None]
+    return boxes, offset + fim
+
+def ler_feed_socket(sock, pendente=b""):
+    """
+    Drena o socket (não bloqueante) e retorna (boxes, bytes_pendentes, encerrado).
+    Se o feed fechou a conexão, o que já chegou é aproveitado (inclusive a última linha sem quebra).
+    """
+    sock.setblocking(False)
+    encerrado = False
+    while True:
+        try:
+            pedaco = sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            break
+        if not pedaco:
+            encerrado = True
+            break
+        pendente += pedaco
+    fim = len(pendente) if encerrado else pendente.rfind(b"\n") + 1
+    boxes = [b for b in (parse_linha_feed(l) for l in pendente[:fim].decode("utf-8", errors="ignore").splitlines()) if b is not None]
+    return boxes, pendente[fim:], encerrado
+
+def painel_ao_vivo(df_indicadores, fonte, endereco, params_estado):
+    """Bloco do sinal do dia. Roda como fragment: só ele é reexecutado a cada intervalo."""
+    chave_cfg = (fonte, endereco, repr(params_estado))
+    sessao = st.session_state.get("ao_vivo")
+    if sessao is None or sessao["cfg"] != chave_cfg:
+        if sessao is not None and sessao.get("sock") is not None:
+            sessao["sock"].close()
+        sessao = {"cfg": chave_cfg, "estado": None, "offset": 0, "sock": None, "pendente": b"", "n_boxes": 0}
+        st.session_state["ao_vivo"] = sessao
+
+    def fechar_socket():
+        # Linha parcial da conexão antiga não pode ser colada na primeira linha da próxima
+        if sessao.get("sock") is not None:
+            sessao["sock"].close()
+        sessao["sock"] = None; sessao["pendente"] = b""
+
+    encerrado = False
+    try:
+        if fonte == "CSV":
+            novos, sessao["offset"] = ler_feed_csv(endereco, sessao["offset"])
+        else:
+            if sessao["sock"] is None:
+                host, _, porta = endereco.rpartition(":")
+                sessao["sock"] = socket.create_connection((host or "127.0.0.1", int(porta)), timeout=2)
+            novos, sessao["pendente"], encerrado = ler_feed_socket(sessao["sock"], sessao["pendente"])
+    except (OSError, ValueError) as e:
+        fechar_socket()
+        st.error(f"Feed indisponível: {e}")
+        return
+    if encerrado:
+        fechar_socket()
+        st.warning("Feed encerrou a conexão; reconectando na próxima atualização.")
+
+    for box in novos:
+        # Virada de dia: o estado é só do dia corrente
+        if sessao["estado"] is None or box["Data"] > sessao["estado"]["data"]:
+            sessao["estado"] = iniciar_estado_ao_vivo(df_indicadores, box["Data"], **params_estado)
+            sessao["n_boxes"] = 0
+        if atualizar_estado_ao_vivo(sessao["estado"], box):
+            sessao["n_boxes"] += 1
+
+    estado = sessao["estado"]
+    st.subheader("Ao Vivo - Sinal do Dia")
+    if estado is None or estado["box1"] is None:
+        st.info("Aguardando o primeiro box do feed.")
+        return
+    if not estado["tem_indicadores"]:
+        st.warning(f"Sem indicadores para {estado['data'].strftime('%d/%m/%Y')} na aba 'Indicadores' (Cenário 0).")
+
+    ultimo = estado["ultimo"]
+    st.caption(f"{estado['data'].strftime('%d/%m/%Y')} · {sessao['n_boxes']} boxes · último box {int(ultimo['Box'])} às {ultimo['Hora'].strftime('%H:%M:%S')}")
+    if int(estado["box1"]["Box"]) != 1:
+        # Feed conectado no meio do pregão: sem o Box 1 a abertura, o cenário e a entrada não valem
+        st.warning(f"O feed começou no box {int(estado['box1']['Box'])}, sem o Box 1 do dia. "
+                   "Cenário e entrada não podem ser calculados; reenvie o feed desde o primeiro box.")
+        return
+    html_vivo = format_playbook_table_for_display(linha_estado_ao_vivo(estado))
+    st.markdown(f'<div class="tabela-container">{html_vivo}</div>', unsafe_allow_html=True)
 
 # =========================================================
 # Página Playbook
@@ -422,6 +1026,7 @@ def pagina_playbook():
         
         /* Hover nas linhas */
         .tabela-container tbody tr:hover { background-color: #374151 !important; }
+        """ + CSS_TABELAS + """
         </style>
         """, unsafe_allow_html=True)
 
@@ -472,10 +1077,34 @@ def pagina_playbook():
             if st.checkbox(nome, value=True, key=f"dia_{dn}"): dias_selecionados.append(dn)
         idx += 1
 
+    st.sidebar.markdown("---")
+    execucao_opcoes = {"Sequencial": None, "Paralela por Mês": "M", "Paralela por Ano": "Y"}
+    execucao = st.sidebar.selectbox("Execução", list(execucao_opcoes.keys()), help=f"Paralela divide o período em partes simuladas em {os.cpu_count() or 1} núcleos.")
+    particao = execucao_opcoes[execucao]
+
+    st.sidebar.markdown("---")
+    st.sidebar.markdown("**Modo Ao Vivo**")
+    usar_ao_vivo = st.sidebar.checkbox("Ativar Modo Ao Vivo", value=False)
+    if usar_ao_vivo:
+        fonte_feed = st.sidebar.radio("Fonte", ["CSV", "Socket"], horizontal=True)
+        endereco_feed = st.sidebar.text_input("Arquivo do feed" if fonte_feed == "CSV" else "Host:Porta", value="feed_boxes.csv" if fonte_feed == "CSV" else "127.0.0.1:9009")
+        intervalo_feed = st.sidebar.number_input("Atualizar a cada (s)", min_value=1, max_value=60, value=5, step=1)
+
     st.sidebar.markdown("---")
     if st.sidebar.button("Gerar Estatística"): st.session_state["playbook_gerado"] = True
     if "playbook_gerado" not in st.session_state: st.session_state["playbook_gerado"] = False
 
+    if usar_ao_vivo:
+        st.markdown("---")
+        params_ao_vivo = {
+            "hora_fim": datetime.strptime(hora_fim_str, "%H:%M").time(), "alvos_config": alvos_config, "pts_stop": pts_stop,
+            "usar_trailing": usar_trailing, "trailing_trigger": trailing_trigger, "trailing_dist": trailing_dist,
+        }
+        # Fragment: o histórico abaixo fica em cache e não é refeito a cada box
+        st.fragment(painel_ao_vivo, run_every=timedelta(seconds=int(intervalo_feed)))(
+            df_indicadores, fonte_feed, endereco_feed, params_ao_vivo
+        )
+
     st.markdown("---")
     if "mostrar_tabela_playbook" not in st.session_state: st.session_state["mostrar_tabela_playbook"] = True
     txt_btn = "Ocultar Tabela" if st.session_state["mostrar_tabela_playbook"] else "Mostrar Tabela"
@@ -487,7 +1116,8 @@ def pagina_playbook():
         hora_fim = datetime.strptime(hora_fim_str, "%H:%M").time()
         tabela = build_playbook_table(
             df_geral, df_indicadores, data_inicio, data_fim, hora_fim,
-            alvos_config, pts_stop, usar_trailing, trailing_trigger, trailing_dist, dias_selecionados
+            alvos_config, pts_stop, usar_trailing, trailing_trigger, trailing_dist, dias_selecionados,
+            paralelo=particao is not None, particao=particao or "M"
         )
 
         if tabela.empty:
@@ -517,6 +1147,7 @@ def pagina_playbook():
                 tbody tr:hover {{ background-color: #374151 !important; cursor: pointer; }}
                 tbody tr.selected {{ background-color: #4b5563 !important; border-left: 4px solid #60a5fa; }}
                 tbody tr.selected td {{ color: #ffffff !important; font-weight: bold; }}
+                {CSS_TABELAS}
             </style>
             </head>
             <body>
@@ -563,24 +1194,27 @@ def pagina_playbook():
         if st.session_state["mostrar_tabela_mensal"]:
             col_mensal, col_stats = st.columns([3, 2])
             
-            # Prepara DF Mensal
+            # Cubo de estatísticas: uma passada, todas as tabelas abaixo saem dele
             tab_agg = tabela.copy()
             tab_agg['Data'] = pd.to_datetime(tab_agg['Data'])
-            tab_agg['MesAno'] = tab_agg['Data'].dt.to_period('M')
-            
-            res_men = tab_agg.groupby('MesAno').agg(
-                **{'Resultado Total': ('Resultado Total', 'sum'), 'Exp Max Neg': ('Dia-Dia', 'min')}
-            ).reset_index().sort_values('MesAno', ascending=False)
+            cubo = build_stats_cube(tab_agg)
+
+            # Prepara DF Mensal (Exp Max Neg = menor acumulado do mês, ou seja, o mínimo do Dia-Dia)
+            res_men = cubo['mensal'][['Resultado Total', 'Acum Min']].rename(columns={'Acum Min': 'Exp Max Neg'})
+            res_men = res_men.sort_index(ascending=False).reset_index()
             
             mes_map = {1: 'Janeiro', 2: 'Fevereiro', 3: 'Março', 4: 'Abril', 5: 'Maio', 6: 'Junho', 7: 'Julho', 8: 'Agosto', 9: 'Setembro', 10: 'Outubro', 11: 'Novembro', 12: 'Dezembro'}
-            res_men['Mês'] = res_men['MesAno'].dt.month.map(mes_map) + " " + res_men['MesAno'].dt.year.astype(str)
+            res_men['Mês'] = res_men['Mês'].map(mes_map) + " " + res_men['Ano'].astype(str)
             res_men = res_men[['Mês', 'Resultado Total', 'Exp Max Neg']]
             
-            styler_m = res_men.style.format({'Resultado Total': fmt_res, 'Exp Max Neg': fmt_res}).map(color_res, subset=['Resultado Total', 'Exp Max Neg']).hide(axis="index")
+            html_m = tabela_html(
+                {'Mês': res_men['Mês'], 'Resultado Total': fmt_res_col(res_men['Resultado Total']), 'Exp Max Neg': fmt_res_col(res_men['Exp Max Neg'])},
+                {'Resultado Total': classe_res_col(res_men['Resultado Total']), 'Exp Max Neg': classe_res_col(res_men['Exp Max Neg'])},
+            )
             
             with col_mensal:
                 st.subheader("Resultado Mensal")
-                st.markdown(f'<div class="tabela-container">{styler_m.to_html(escape=False)}</div>', unsafe_allow_html=True)
+                st.markdown(f'<div class="tabela-container">{html_m}</div>', unsafe_allow_html=True)
 
             with col_stats:
                 st.subheader("Resumo Anual Consolidado")
@@ -645,14 +1279,8 @@ def pagina_playbook():
                 # ---------------------------------------------------------
                 # 2. CÁLCULOS POR ANO
                 # ---------------------------------------------------------
-                resumo_ano = tab_agg.groupby('Ano').agg(
-                    Resultado_Total=('Resultado Total', 'sum'),
-                    Total_Trades=('Resultado Total', 'count'),
-                    Ganhos_Brutos=('Resultado Total', lambda x: x[x > 0].sum()),
-                    Perdas_Brutas=('Resultado Total', lambda x: x[x < 0].sum()),
-                    Dias_Positivos=('Resultado Total', lambda x: (x > 0).sum()),
-                    Dias_Negativos=('Resultado Total', lambda x: (x < 0).sum()),
-                )
+                resumo_ano = cube_rollup(cubo, ['Ano'])[['Resultado Total', 'Trades', 'Ganhos Brutos', 'Perdas Brutas', 'Dias (+)', 'Dias (-)']]
+                resumo_ano.columns = ['Resultado_Total', 'Total_Trades', 'Ganhos_Brutos', 'Perdas_Brutas', 'Dias_Positivos', 'Dias_Negativos']
                 
                 resumo_streaks = tab_agg.groupby('Ano').apply(get_streak_data)
                 df_final = pd.concat([resumo_ano, resumo_streaks], axis=1)
@@ -676,27 +1304,27 @@ def pagina_playbook():
                 # ---------------------------------------------------------
                 
                 # --- Linha Total ---
-                total_res = tab_agg['Resultado Total'].sum()
-                total_pos = (tab_agg['Resultado Total'] > 0).sum()
-                total_neg = (tab_agg['Resultado Total'] < 0).sum()
-                total_count = tab_agg['Resultado Total'].count()
-                total_gross_gain = tab_agg[tab_agg['Resultado Total'] > 0]['Resultado Total'].sum()
-                total_gross_loss = tab_agg[tab_agg['Resultado Total'] < 0]['Resultado Total'].sum()
+                total = cube_rollup(cubo).iloc[0]
+                total_res = total['Resultado Total']
+                total_pos = total['Dias (+)']
+                total_neg = total['Dias (-)']
+                total_count = total['Trades']
+                total_gross_gain = total['Ganhos Brutos']
+                total_gross_loss = total['Perdas Brutas']
                 
                 total_taxa = total_pos / total_count if total_count > 0 else 0
                 total_fator_lucro = total_gross_gain / abs(total_gross_loss) if total_gross_loss != 0 else 0
 
                 # --- Métricas Extras ---
-                media_gain_dia = tab_agg[tab_agg['Resultado Total'] > 0]['Resultado Total'].mean()
-                media_loss_dia = tab_agg[tab_agg['Resultado Total'] < 0]['Resultado Total'].mean()
-                media_dia = tab_agg['Resultado Total'].mean()
+                media_gain_dia = total['Média Gain']
+                media_loss_dia = total['Média Loss']
+                media_dia = total['Média/Dia']
                 
                 # Média Mensal
-                tab_agg['MesAno'] = tab_agg['Data'].dt.to_period('M')
-                media_mensal = tab_agg.groupby('MesAno')['Resultado Total'].sum().mean()
+                media_mensal = total_res / len(cubo['mensal'])
                 
                 # Volatilidade (Desvio Padrão Diário)
-                volatilidade = tab_agg['Resultado Total'].std()
+                volatilidade = total['Volatilidade']
                 
                 # Lógica de Status da Volatilidade
                 status_vol = "-"
@@ -711,12 +1339,8 @@ def pagina_playbook():
                 else:
                     status_vol = "N/A"
                 
-                # Drawdown Máximo
-                df_sorted = tab_agg.sort_values('Data')
-                cumsum = df_sorted['Resultado Total'].cumsum()
-                peak = cumsum.cummax()
-                drawdown = cumsum - peak
-                max_drawdown = drawdown.min()
+                # Drawdown Máximo (meses encadeados em ordem cronológica)
+                max_drawdown = cube_trajetoria(cubo, 'Total')['Drawdown'].iloc[0]
                 
                 # Fator de Recuperação
                 fator_recuperacao = (total_res / abs(max_drawdown)) if max_drawdown != 0 else 0
@@ -752,43 +1376,99 @@ def pagina_playbook():
                 # 4. FORMATAÇÃO E ESTILO
                 # ---------------------------------------------------------
                 
-                # Função aprimorada para aceitar TEXTO também
-                def fmt_percent(v):
-                    if isinstance(v, str): return v 
-                    return f"{v*100:.2f}%".replace('.', ',') if pd.notnull(v) and v != "" else ""
-                
-                def fmt_decimal(v):
-                    if isinstance(v, str): return v
-                    return f"{v:.2f}".replace('.', ',') if pd.notnull(v) and v != "" else ""
-                
-                def fmt_inteiro(v):
-                    return f"{int(v)}" if pd.notnull(v) and v != "" else ""
-
-                # Aplica estilos
-                styler_final = df_display.fillna("").style\
-                    .format({
-                        'Resultado Total': fmt_res,
-                        'Taxa Acerto': fmt_percent, 
-                        col_fator_lucro_html: fmt_decimal, # Usar a chave HTML aqui também
-                        'Dias (+)': fmt_inteiro,
-                        'Dias (-)': fmt_inteiro,
-                        'Max Gain (dias)': fmt_inteiro,
-                        'Max Loss (dias)': fmt_inteiro
-                    })\
-                    .map(color_res, subset=['Resultado Total'])\
-                    .map(lambda v: "color: #22c55e; font-weight: bold;" if isinstance(v, (int, float)) and v > 0 else "", subset=['Dias (+)'])\
-                    .map(lambda v: "color: #ef4444; font-weight: bold;" if isinstance(v, (int, float)) and v > 0 else "", subset=['Dias (-)'])\
-                    .map(lambda v: "color: #22c55e; font-weight: bold;" if v == "Controlada" else 
-                                   "color: #facc15; font-weight: bold;" if v == "Moderada" else 
-                                   "color: #ef4444; font-weight: bold;" if v == "Alta" else "", subset=['Taxa Acerto'])
-
-                # Destaca a linha de Total com um fundo diferente (opcional, via CSS do Pandas)
-                styler_final = styler_final.apply(lambda x: ['background-color: #374151' if x.name == 'Total' else '' for i in x], axis=1)
-
-                st.markdown(f'<div class="tabela-container">{styler_final.to_html(escape=False)}</div>', unsafe_allow_html=True)
+                # Formatadores por coluna (textos como "Controlada" ou "" passam direto)
+                tab_final = df_display.fillna("")
+                fmt_cols = {
+                    'Resultado Total': fmt_res_col,
+                    'Taxa Acerto': fmt_percent_col,
+                    col_fator_lucro_html: fmt_decimal_col, # Usar a chave HTML aqui também
+                    'Dias (+)': fmt_inteiro_col,
+                    'Dias (-)': fmt_inteiro_col,
+                    'Max Gain (dias)': fmt_inteiro_col,
+                    'Max Loss (dias)': fmt_inteiro_col
+                }
+                textos = formatar_colunas(tab_final, fmt_cols)
+                classes = {
+                    'Resultado Total': classe_res_col(tab_final['Resultado Total']),
+                    'Dias (+)': np.where(pd.to_numeric(tab_final['Dias (+)'], errors="coerce") > 0, "destaque-pos", ""),
+                    'Dias (-)': np.where(pd.to_numeric(tab_final['Dias (-)'], errors="coerce") > 0, "destaque-neg", ""),
+                    'Taxa Acerto': classe_mapa_col(tab_final['Taxa Acerto'], {"Controlada": "destaque-pos", "Moderada": "destaque-alerta", "Alta": "destaque-neg"}),
+                }
+
+                # Destaca a linha de Total com um fundo diferente
+                classes_linha = np.where(tab_final.index == 'Total', "linha-total", "")
+                html_final = tabela_html(textos, classes, indice=tab_final.index, classes_linha=classes_linha)
+
+                st.markdown(f'<div class="tabela-container">{html_final}</div>', unsafe_allow_html=True)
                 st.markdown("<br>", unsafe_allow_html=True)
+
+            # ---------------------------------------------------------
+            # QUEBRA POR DIMENSÃO (fatias do cubo, sem reler as operações)
+            # ---------------------------------------------------------
+            st.subheader("Resultado por Dimensão")
+            quebra_opcoes = {"Cenário": ["Cenário"], "Entrada": ["Entrada"], "Dia da Semana": ["Dia Semana"],
+                             "Ano x Cenário": ["Ano", "Cenário"], "Cenário x Entrada": ["Cenário", "Entrada"]}
+            quebra = st.selectbox("Quebrar por", list(quebra_opcoes.keys()))
+            res_dim = cube_rollup(cubo, quebra_opcoes[quebra])
+            res_dim = res_dim[['Resultado Total', 'Trades', 'Taxa Acerto', 'Fator de Lucro', 'Payoff', 'Média/Dia', 'Dias (+)', 'Dias (-)']].reset_index()
+            if "Dia Semana" in res_dim.columns:
+                res_dim["Dia Semana"] = res_dim["Dia Semana"].map({0: "Seg", 1: "Ter", 2: "Qua", 3: "Qui", 4: "Sex", 5: "Sáb", 6: "Dom"})
+            if "Entrada" in res_dim.columns:
+                res_dim["Entrada"] = res_dim["Entrada"].replace("", "Sem Entrada")
+
+            html_dim = tabela_html(
+                formatar_colunas(res_dim, {
+                    'Resultado Total': fmt_res_col, 'Média/Dia': fmt_res_col, 'Taxa Acerto': fmt_percent_col,
+                    'Fator de Lucro': fmt_decimal_col, 'Payoff': fmt_decimal_col,
+                }),
+                {'Resultado Total': classe_res_col(res_dim['Resultado Total']), 'Média/Dia': classe_res_col(res_dim['Média/Dia'])},
+            )
+            st.markdown(f'<div class="tabela-container">{html_dim}</div>', unsafe_allow_html=True)
         else:
             st.info("Resultado Mensal está oculto.")
+
+        # =========================================================
+        # SENSIBILIDADE DOS NÍVEIS (SWEEP DE OFFSETS)
+        # =========================================================
+        st.markdown("---")
+        with st.expander("Sensibilidade dos Níveis (Offsets)"):
+            cs1, cs2 = st.columns([3, 2])
+            offsets_str = cs1.text_input("Offsets (pts, separados por vírgula)", value="-100, -50, 0, 50, 100")
+            niveis_sweep = cs2.selectbox("Níveis deslocados", ["Todos", "VAL/VAH", "Injustas"])
+            st.caption("Offset positivo afasta os níveis da abertura (VAL/Min Inj - N, VAH/Max Inj + N).")
+            try:
+                offsets = sorted({int(o) for o in offsets_str.replace(";", ",").split(",") if o.strip()})
+            except ValueError:
+                offsets = []; st.error("Offsets inválidos: use pontos inteiros (ex.: -50, 0, 50).")
+
+            # O resultado guardado só vale para os parâmetros com que foi gerado
+            chave_sweep = repr((offsets, niveis_sweep, data_inicio, data_fim, hora_fim, alvos_config,
+                                pts_stop, usar_trailing, trailing_trigger, trailing_dist, dias_selecionados))
+            if offsets and st.button("Rodar Sweep"):
+                st.session_state["sweep_offsets"] = {
+                    "parametros": chave_sweep,
+                    "resultado": sweep_offsets(
+                        df_geral, df_indicadores, offsets, niveis_sweep, data_inicio, data_fim, hora_fim,
+                        alvos_config, pts_stop, usar_trailing, trailing_trigger, trailing_dist, dias_selecionados
+                    ),
+                }
+
+            guardado = st.session_state.get("sweep_offsets")
+            res_sweep = None
+            if guardado is not None:
+                if guardado["parametros"] == chave_sweep:
+                    res_sweep = guardado["resultado"]
+                else:
+                    st.info("Parâmetros alterados. Clique em **Rodar Sweep** para atualizar.")
+            if res_sweep is not None and not res_sweep.empty:
+                html_s = tabela_html(
+                    formatar_colunas(res_sweep, {
+                        'Offset': fmt_offset_col, 'Resultado Total': fmt_res_col, 'Drawdown Máximo': fmt_res_col,
+                        'Taxa Acerto': fmt_percent_col, 'Fator de Lucro': fmt_decimal_col,
+                    }),
+                    {'Resultado Total': classe_res_col(res_sweep['Resultado Total']), 'Drawdown Máximo': classe_res_col(res_sweep['Drawdown Máximo'])},
+                )
+                st.markdown(f'<div class="tabela-container">{html_s}</div>', unsafe_allow_html=True)
     else:
         st.info("Ajuste os filtros e clique em **Gerar Estatística**.")
 